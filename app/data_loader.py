@@ -1,8 +1,16 @@
 from __future__ import annotations
-import json, os, pickle
-from collections import Counter, defaultdict
+import os
+from collections import defaultdict
+from itertools import chain
 from typing import Optional
+import numpy as np
+import orjson
+from joblib import Parallel, delayed
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+import scipy.sparse as sp
 
 # --- Directories ---
 DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")
@@ -25,16 +33,21 @@ def _check_file_size(path: str):
             f"Max allowed size = {MAX_FILE_SIZE / (1024*1024)} MB."
         )
 
-def _load_large_csv(path: str, chunksize: int = 200000) -> pd.DataFrame:
+def read_csv_arrow(path, block_size: int = 64 << 20) -> pd.DataFrame:
     """
-    Load CSV in chunks to handle large files.
+    Read a CSV (path or file-like) with Arrow's multithreaded parser into an
+    Arrow-backed DataFrame (no chunk list + concat copy).
+    """
+    table = pacsv.read_csv(path, read_options=pacsv.ReadOptions(block_size=block_size, use_threads=True))
+    return table.to_pandas(types_mapper=pd.ArrowDtype)
+
+def _load_large_csv(path: str) -> pd.DataFrame:
+    """
+    Load large CSV files via Arrow.
     Enforces 700MB max file size.
     """
     _check_file_size(path)
-    dfs = []
-    for chunk in pd.read_csv(path, chunksize=chunksize):
-        dfs.append(chunk)
-    return pd.concat(dfs, ignore_index=True)
+    return read_csv_arrow(path)
 
 def load_csvs() -> dict:
     paths = {
@@ -56,7 +69,7 @@ NON_ITEMS = ["memo", "blankline", "asap", "order"]
 
 def extract_item_names(order_str: str) -> list[str]:
     try:
-        order_json = json.loads(order_str)
+        order_json = orjson.loads(order_str)
         item_names = []
         for order in order_json.get("orders", []):
             for item in order.get("item_details", []):
@@ -70,6 +83,26 @@ def extract_item_names(order_str: str) -> list[str]:
 def clean_item_list(item_list: list[str]) -> list[str]:
     return [it for it in item_list if not any(sw in it.lower() for sw in NON_ITEMS)]
 
+def _parse_and_clean(chunk) -> list[list[str]]:
+    return [clean_item_list(extract_item_names(s)) for s in chunk]
+
+def parse_item_lists(orders: pd.Series, n_chunks: int = 64, min_parallel: int = 50_000) -> pd.Series:
+    """
+    Parse + clean the ORDERS JSON column into item lists, spreading the
+    chunks over worker processes for large inputs.
+    """
+    values = orders.to_numpy(dtype=object)
+    if len(values) < min_parallel:
+        parts = [_parse_and_clean(values)]
+    else:
+        parts = Parallel(n_jobs=os.cpu_count(), prefer="processes")(
+            delayed(_parse_and_clean)(chunk) for chunk in np.array_split(values, n_chunks)
+        )
+    return pd.Series(list(chain.from_iterable(parts)), index=orders.index)
+
+ITEM_TYPES = ("main", "side", "dip", "drink", "other")
+TYPE_TO_CODE = {t: i for i, t in enumerate(ITEM_TYPES)}
+
 def tag_item_type(name: str) -> str:
     n = name.lower()
     if any(k in n for k in ["combo","feast","meal","wings","strips","flavor platter","sub","box","lunch","crispy"]):
@@ -102,62 +135,152 @@ def extract_item_features(item_name: str) -> set[str]:
     return tags
 
 def build_items_and_tags(order_df: pd.DataFrame) -> tuple[dict, dict, dict, list[str]]:
-    order_df = order_df.copy()
-    order_df["ITEM_LIST"] = order_df["ORDERS"].apply(extract_item_names).apply(clean_item_list)
+    if "ITEM_LIST" not in order_df:
+        order_df = order_df.copy()
+        order_df["ITEM_LIST"] = parse_item_lists(order_df["ORDERS"])
+
+    flat = pd.Series(list(chain.from_iterable(order_df["ITEM_LIST"])), dtype=object)
+    cnt = flat.value_counts()  # most frequent first
 
-    all_items = sorted({it for row in order_df["ITEM_LIST"] for it in row})
+    all_items = sorted(cnt.index)
     item_type_dict = {it: tag_item_type(it) for it in all_items}
     item_feature_dict = {it: extract_item_features(it) for it in all_items}
 
-    cnt = Counter([it for row in order_df["ITEM_LIST"] for it in row])
     top_items_by_type = defaultdict(list)
-    for item, c in cnt.items():
-        t = item_type_dict.get(item, "other")
+    for t, grp in cnt.groupby(cnt.index.map(item_type_dict), sort=False):
         if t in ["main","side","dip","drink"]:
-            top_items_by_type[t].append((item, c))
-    for t in top_items_by_type:
-        top_items_by_type[t].sort(key=lambda x: -x[1])
+            top_items_by_type[t] = [(it, int(c)) for it, c in grp.items()]
 
     return item_type_dict, item_feature_dict, top_items_by_type, all_items
 
-def build_normalized_comatrix(order_df: pd.DataFrame, sample_n: Optional[int] = None) -> dict:
+def build_normalized_comatrix(order_df: pd.DataFrame, sample_n: Optional[int] = None,
+                              items: Optional[list[str]] = None) -> tuple[sp.csr_matrix, list[str]]:
+    """
+    Row-normalized co-occurrence matrix: entry [a, b] is the share of orders
+    containing `a` that also contain `b`. Returns the CSR matrix together with
+    the item names labelling its rows/columns (`items` if given).
+    """
     if sample_n:
         order_df = order_df.sample(n=min(sample_n, len(order_df)), random_state=42)
 
     lists = order_df["ITEM_LIST"]
-    item_count = defaultdict(int)
-    pair_count = defaultdict(lambda: defaultdict(int))
-
-    for items in lists:
-        uniq = list(set(items))
-        for i in uniq:
-            item_count[i] += 1
-        for i in range(len(uniq)):
-            for j in range(len(uniq)):
-                if i == j:
-                    continue
-                a, b = uniq[i], uniq[j]
-                pair_count[a][b] += 1
-
-    norm = defaultdict(dict)
-    for a in pair_count:
-        denom = item_count[a] or 1
-        for b, c in pair_count[a].items():
-            norm[a][b] = c / denom
-    return norm
+    lengths = lists.map(len).to_numpy()
+    rows = np.repeat(np.arange(len(lists)), lengths)
+    flat = np.fromiter(chain.from_iterable(lists), dtype=object, count=int(lengths.sum()))
+
+    if items is None:
+        cols, uniques = pd.factorize(flat, sort=True)
+        items = list(uniques)
+    else:
+        cols = pd.Index(items).get_indexer(flat)
+        known = cols >= 0
+        rows, cols = rows[known], cols[known]
+
+    # orders x items 0/1 indicator (duplicates within an order count once)
+    O = sp.csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, cols)),
+                      shape=(len(lists), len(items)))
+    O.data[:] = 1.0
+
+    co = (O.T @ O).tocsr()
+    item_count = co.diagonal()
+    co = (co - sp.diags(item_count)).tocsr()
+    co.eliminate_zeros()
+
+    denom = np.where(item_count > 0, item_count, 1).astype(np.float32)
+    co_norm = (sp.diags(1.0 / denom) @ co).tocsr().astype(np.float32)
+    return co_norm, items
+
+def quantize_comatrix(co_norm: sp.csr_matrix) -> tuple[sp.csr_matrix, np.ndarray]:
+    """
+    Store each row as uint16 fixed point relative to the row max.
+    Returns (q, scale) with co_norm ~= diag(scale) @ q.
+    """
+    co_norm = co_norm.tocsr()
+    row_max = co_norm.max(axis=1).toarray().ravel().astype(np.float32)
+    scale = np.where(row_max > 0, row_max / 65535, 1).astype(np.float32)
+    rows = np.repeat(np.arange(co_norm.shape[0]), np.diff(co_norm.indptr))
+    # keep tiny scores non-zero so the sparsity pattern is unchanged
+    data = np.maximum(np.rint(co_norm.data / scale[rows]), 1).astype(np.uint16)
+    q = sp.csr_matrix((data, co_norm.indices.copy(), co_norm.indptr.copy()), shape=co_norm.shape)
+    return q, scale
 
 # ---------------- Artifacts ---------------- #
 
+ARTIFACT_KEYS = ("item_type", "item_feat", "top_by_type", "co_norm", "co_scale", "co_items",
+                 "lower_to_orig")
+
+def add_lookups(art: dict) -> dict:
+    """Attach lookup structures derived from the stored keys (not persisted)."""
+    items = art["co_items"]
+    art["known_lower_arr"] = np.array(list(art["lower_to_orig"]), dtype=object)
+    art["item_names"] = np.array(items, dtype=object)
+    art["item_index"] = {it: i for i, it in enumerate(items)}
+    art["item_id_to_type_code"] = np.asarray(
+        [TYPE_TO_CODE[art["item_type"].get(it, "other")] for it in items], dtype=np.uint8)
+    art["item_spicy"] = np.array(["spicy" in art["item_feat"].get(it, ()) for it in items], dtype=bool)
+    return art
+
+def _json_default(obj):
+    if isinstance(obj, (set, frozenset)):
+        return sorted(obj)
+    raise TypeError(f"Cannot serialize {type(obj).__name__}")
+
 def save_artifact(name: str, obj):
+    """Write one artifact under ART_DIR; sparse -> .npz, array -> .npy, Arrow table -> .parquet, else .json."""
     ensure_dirs()
-    p = os.path.join(ART_DIR, name)
-    with open(p, "wb") as f:
-        pickle.dump(obj, f)
+    if sp.issparse(obj):
+        p = os.path.join(ART_DIR, f"{name}.npz")
+        sp.save_npz(p, obj.tocsr())
+    elif isinstance(obj, np.ndarray):
+        p = os.path.join(ART_DIR, f"{name}.npy")
+        np.save(p, obj, allow_pickle=False)
+    elif isinstance(obj, pa.Table):
+        p = os.path.join(ART_DIR, f"{name}.parquet")
+        pq.write_table(obj, p, compression="zstd")
+    else:
+        p = os.path.join(ART_DIR, f"{name}.json")
+        with open(p, "wb") as f:
+            f.write(orjson.dumps(obj, default=_json_default))
     return p
 
 def load_artifact(name: str):
-    p = os.path.join(ART_DIR, name)
-    if os.path.exists(p):
-        with open(p, "rb") as f:
-            return pickle.load(f)
+    base = os.path.join(ART_DIR, name)
+    if os.path.exists(base + ".npz"):
+        return sp.load_npz(base + ".npz").tocsr()
+    if os.path.exists(base + ".npy"):
+        return np.load(base + ".npy", allow_pickle=False)
+    if os.path.exists(base + ".parquet"):
+        return pq.read_table(base + ".parquet")
+    if os.path.exists(base + ".json"):
+        with open(base + ".json", "rb") as f:
+            return orjson.loads(f.read())
     return None
+
+def save_artifacts(art: dict) -> str:
+    for key in ARTIFACT_KEYS:
+        obj = art[key]
+        if key == "top_by_type":
+            rows = [(t, it, int(c)) for t, lst in obj.items() for it, c in lst]
+            obj = pa.Table.from_pydict({
+                "type": [r[0] for r in rows],
+                "item": [r[1] for r in rows],
+                "count": [r[2] for r in rows],
+            })
+        save_artifact(key, obj)
+    return ART_DIR
+
+def load_artifacts() -> Optional[dict]:
+    art = {}
+    for key in ARTIFACT_KEYS:
+        obj = load_artifact(key)
+        if obj is None:
+            return None
+        art[key] = obj
+
+    top = defaultdict(list)
+    cols = art["top_by_type"].to_pydict()
+    for t, it, c in zip(cols["type"], cols["item"], cols["count"]):
+        top[t].append((it, c))
+    art["top_by_type"] = top
+    art["item_feat"] = {it: set(tags) for it, tags in art["item_feat"].items()}
+    return add_lookups(art)
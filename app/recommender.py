@@ -1,7 +1,12 @@
 from __future__ import annotations
-from collections import defaultdict, Counter
 from difflib import get_close_matches
-from typing import List, Dict, Tuple, Iterable, Optional
+from typing import List, Dict, Tuple, Iterable
+import numpy as np
+import scipy.sparse as sp
+from numba import njit
+from rapidfuzz import fuzz, process
+
+from data_loader import ITEM_TYPES, TYPE_TO_CODE
 
 # Blacklist items we never recommend
 DEFAULT_BLACKLIST = {
@@ -9,65 +14,163 @@ DEFAULT_BLACKLIST = {
     "Delivery Fee","Unavailable Item","Ketchup Pack","Seasoning Pack","Extra Sauce"
 }
 
-def enhanced_recommend(cart_items: List[str],
-                       co_dict: Dict[str, Dict[str, float]],
-                       item_type: Dict[str,str],
-                       top_items_by_type: Dict[str, List[Tuple[str,int]]],
-                       item_tags: Dict[str,set],
-                       blacklist: set[str] = DEFAULT_BLACKLIST,
-                       top_n: int = 3,
-                       boost_factor: float = 1.2,
-                       max_per_type: int = 1) -> List[Tuple[str, float]]:
-    """Type-aware, spicy-aware, fallback-enabled recommender returning (item, score)."""
-    score = defaultdict(float)
-    cart_types = Counter([item_type.get(x, "other") for x in cart_items])
-    cart_has_spicy = any("spicy" in item_tags.get(x, set()) for x in cart_items)
-
-    # 1) score from co-occurrence matrix
-    for it in cart_items:
-        if it not in co_dict:
+@njit(cache=True)
+def _topk_row(scores, type_codes, n_types, max_per_type, top_n, out_ids, out_vals):
+    # best `max_per_type` per type in bounded, best-first buffers (ties keep the lower id)
+    buf_v = np.full((n_types, max_per_type), -np.inf)
+    buf_i = np.full((n_types, max_per_type), -1, dtype=np.int64)
+    last = max_per_type - 1
+    for j in range(scores.shape[0]):
+        v = scores[j]
+        t = type_codes[j]
+        if v == -np.inf or v <= buf_v[t, last]:
             continue
-        for co_it, cnt in co_dict[it].items():
-            if co_it in cart_items or co_it in blacklist:
+        k = last
+        while k > 0 and buf_v[t, k - 1] < v:
+            buf_v[t, k] = buf_v[t, k - 1]
+            buf_i[t, k] = buf_i[t, k - 1]
+            k -= 1
+        buf_v[t, k] = v
+        buf_i[t, k] = j
+
+    # merge the per-type buffers, best head first
+    heads = np.zeros(n_types, dtype=np.int64)
+    for r in range(top_n):
+        best_t, best_v, best_j = -1, -np.inf, -1
+        for t in range(n_types):
+            h = heads[t]
+            if h > last or buf_i[t, h] < 0:
                 continue
-            t = item_type.get(co_it, "other")
-            tags = item_tags.get(co_it, set())
-            spicy_bonus = cnt*0.3 if ("spicy" in tags and not cart_has_spicy) else (cnt*0.1 if "spicy" in tags else 0.0)
-            if cart_types.get(t, 0) == 0 and t == "drink":
-                score[co_it] += cnt*(boost_factor*1.5) + spicy_bonus
-            elif cart_types.get(t, 0) == 0:
-                score[co_it] += cnt*boost_factor + spicy_bonus
-            else:
-                score[co_it] += cnt + spicy_bonus
-
-    # 2) top-N with 1 per type
-    sorted_items = sorted(score.items(), key=lambda x: x[1], reverse=True)
-    reco, used_type = [], Counter()
-    for it, sc in sorted_items:
-        t = item_type.get(it, "other")
-        if used_type[t] >= max_per_type:
-            continue
-        reco.append((it, round(float(sc), 4)))
-        used_type[t] += 1
-        if len(reco) >= top_n:
+            v, j = buf_v[t, h], buf_i[t, h]
+            if best_t < 0 or v > best_v or (v == best_v and j < best_j):
+                best_t, best_v, best_j = t, v, j
+        if best_t < 0:
+            break
+        out_ids[r] = best_j
+        out_vals[r] = best_v
+        heads[best_t] += 1
+
+# Deliberately serial: Streamlit calls this from one thread per session, and numba's
+# fallback "workqueue" threading layer aborts the process on concurrent parallel calls.
+@njit(cache=True)
+def _topk_per_type(scores, type_codes, n_types, max_per_type, top_n):
+    """
+    Per row: the `top_n` highest finite scores with at most `max_per_type`
+    per type code, best first. Same picks as walking the row in descending
+    order and skipping full types. Padded with id -1.
+    """
+    n_rows = scores.shape[0]
+    ids = np.full((n_rows, top_n), -1, dtype=np.int64)
+    vals = np.zeros((n_rows, top_n), dtype=np.float64)
+    for r in range(n_rows):
+        _topk_row(scores[r], type_codes, n_types, max_per_type, top_n, ids[r], vals[r])
+    return ids, vals
+
+# compile at import so the first Recommend click does not pay for the JIT
+_topk_per_type(np.zeros((1, 2)), np.zeros(2, dtype=np.uint8), len(ITEM_TYPES), 1, 1)
+
+def _pick_diverse(top_ids: np.ndarray,
+                  top_vals: np.ndarray,
+                  cart_items: List[str],
+                  item_names: np.ndarray,
+                  item_type_codes: np.ndarray,
+                  top_items_by_type: Dict[str, List[Tuple[str,int]]],
+                  blacklist: set[str],
+                  top_n: int,
+                  max_per_type: int) -> List[Tuple[str, float]]:
+    """Turn one row of `_topk_per_type` output into (item, score), then fill from popular items."""
+    reco, used_type = [], np.zeros(len(ITEM_TYPES), dtype=np.int64)
+    for j, sc in zip(top_ids, top_vals):
+        if j < 0:
             break
+        reco.append((item_names[j], round(float(sc), 4)))
+        used_type[item_type_codes[j]] += 1
 
-    # 3) fallback fill
+    # fallback fill
     if len(reco) < top_n:
         for t in ["main","side","dip","drink"]:
-            if used_type[t] >= max_per_type:
+            if used_type[TYPE_TO_CODE[t]] >= max_per_type:
                 continue
             for cand, _ in top_items_by_type.get(t, []):
                 if cand in cart_items or cand in [r[0] for r in reco] or cand in blacklist:
                     continue
                 reco.append((cand, 0.0))
-                used_type[t] += 1
+                used_type[TYPE_TO_CODE[t]] += 1
                 if len(reco) >= top_n: break
             if len(reco) >= top_n: break
     return reco[:top_n]
 
+def _score_carts(carts: List[List[str]],
+                 co_norm: sp.csr_matrix,
+                 co_scale: np.ndarray,
+                 item_index: Dict[str,int],
+                 item_type_codes: np.ndarray,
+                 item_spicy: np.ndarray,
+                 blacklist: set[str],
+                 boost_factor: float) -> np.ndarray:
+    """
+    Score every cart against every item id in one sparse matmul. Missing
+    categories get `boost_factor` (x1.5 for drinks), spicy items a bonus that
+    is larger when the cart has nothing spicy yet. Items that are in the cart,
+    blacklisted or never co-occur get -inf.
+    """
+    n_items = len(item_type_codes)
+    rows, cols, has_unknown = [], [], np.zeros(len(carts), dtype=bool)
+    for r, cart in enumerate(carts):
+        for it in cart:
+            j = item_index.get(it)
+            if j is None:
+                has_unknown[r] = True
+            else:
+                rows.append(r); cols.append(j)
+    U = sp.csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, cols)),
+                      shape=(len(carts), n_items))
+    S = ((U @ sp.diags(co_scale)) @ co_norm).toarray()
+
+    # which types each cart already has (unknown cart items count as "other")
+    T = sp.csr_matrix((np.ones(n_items, dtype=np.float32), (np.arange(n_items), item_type_codes)),
+                      shape=(n_items, len(ITEM_TYPES)))
+    present = (U @ T).toarray() > 0
+    present[:, TYPE_TO_CODE["other"]] |= has_unknown
+
+    missing = ~present[:, item_type_codes]
+    is_drink = item_type_codes == TYPE_TO_CODE["drink"]
+    factor = np.where(missing, np.where(is_drink, boost_factor*1.5, boost_factor), 1.0)
+    cart_spicy = (U @ item_spicy.astype(np.float32)) > 0
+    factor = factor + np.outer(np.where(cart_spicy, 0.1, 0.3), item_spicy)
+
+    scores = S * factor
+    scores[S <= 0] = -np.inf
+    scores[U.nonzero()] = -np.inf
+    scores[:, [item_index[b] for b in blacklist if b in item_index]] = -np.inf
+    return scores
+
+def enhanced_recommend(cart_items: List[str],
+                       co_norm: sp.csr_matrix,
+                       co_scale: np.ndarray,
+                       item_index: Dict[str,int],
+                       item_names: np.ndarray,
+                       item_type_codes: np.ndarray,
+                       item_spicy: np.ndarray,
+                       top_items_by_type: Dict[str, List[Tuple[str,int]]],
+                       blacklist: set[str] = DEFAULT_BLACKLIST,
+                       top_n: int = 3,
+                       boost_factor: float = 1.2,
+                       max_per_type: int = 1) -> List[Tuple[str, float]]:
+    """Type-aware, spicy-aware, fallback-enabled recommender returning (item, score)."""
+    scores = _score_carts([cart_items], co_norm, co_scale, item_index, item_type_codes,
+                          item_spicy, blacklist, boost_factor)
+    ids, vals = _topk_per_type(scores, item_type_codes, len(ITEM_TYPES), max_per_type, top_n)
+    return _pick_diverse(ids[0], vals[0], cart_items, item_names, item_type_codes,
+                         top_items_by_type, blacklist, top_n, max_per_type)
+
+def _prefilter_cutoff(cutoff: float) -> float:
+    # fuzz.ratio (LCS-based) is never below difflib's ratio, so everything
+    # get_close_matches would accept survives this cutoff; the epsilon absorbs float rounding
+    return cutoff * 100 - 1e-6
+
 def normalize_user_items(raw_items: Iterable[str],
-                         known_items_lower: List[str],
+                         known_lower_arr: np.ndarray,
                          lower_to_orig: Dict[str,str],
                          cutoff: float = 0.75) -> List[str]:
     mapped = []
@@ -77,21 +180,61 @@ def normalize_user_items(raw_items: Iterable[str],
         lx = x.lower()
         if lx in lower_to_orig:
             mapped.append(lower_to_orig[lx]); continue
-        m = get_close_matches(lx, known_items_lower, n=1, cutoff=cutoff)
+        cands = process.extract(lx, known_lower_arr, scorer=fuzz.ratio,
+                                score_cutoff=_prefilter_cutoff(cutoff), limit=None)
+        m = get_close_matches(lx, [c[0] for c in cands], n=1, cutoff=cutoff)
         mapped.append(lower_to_orig[m[0]] if m else x)
     return mapped
 
+def _normalize_carts(raw: np.ndarray,
+                     known_lower_arr: np.ndarray,
+                     lower_to_orig: Dict[str,str],
+                     cutoff: float = 0.75) -> List[List[str]]:
+    """Map an (n_rows, n_cols) object array of raw cart cells to known item names."""
+    valid = np.frompyfunc(lambda x: isinstance(x, str) and bool(x.strip()), 1, 1)(raw).astype(bool)
+    lowered = np.where(valid, np.char.lower(raw.astype(str)), "")
+    exact = valid & np.isin(lowered, known_lower_arr)
+
+    # only the misses go through fuzzy matching: each distinct string once, one cdist
+    # prefilter, then difflib decides among the few surviving candidates
+    misses = [str(m) for m in np.unique(raw[valid & ~exact].astype(str))]
+    fuzzy = {m: m for m in misses}
+    if len(misses) and len(known_lower_arr):
+        lowered_misses = [m.lower() for m in misses]
+        sim = process.cdist(lowered_misses, known_lower_arr, scorer=fuzz.ratio,
+                            score_cutoff=_prefilter_cutoff(cutoff), workers=-1)
+        for m, lm, row in zip(misses, lowered_misses, sim):
+            close = get_close_matches(lm, known_lower_arr[row > 0], n=1, cutoff=cutoff)
+            if close:
+                fuzzy[m] = lower_to_orig[close[0]]
+
+    carts = []
+    for r in range(raw.shape[0]):
+        cart = []
+        for c in range(raw.shape[1]):
+            if exact[r, c]:
+                cart.append(lower_to_orig[lowered[r, c]])
+            elif valid[r, c]:
+                cart.append(fuzzy[raw[r, c]])
+        carts.append(cart)
+    return carts
+
 def batch_predict(test_df,
-                  co_dict, item_type, top_items_by_type, item_tags,
-                  known_items_lower, lower_to_orig,
-                  blacklist=DEFAULT_BLACKLIST, top_n=3):
+                  co_norm, co_scale, item_index, item_names, item_type_codes, item_spicy,
+                  top_items_by_type, known_lower_arr, lower_to_orig,
+                  blacklist=DEFAULT_BLACKLIST, top_n=3,
+                  boost_factor=1.2, max_per_type=1):
     out = test_df.copy()
     for col in ["RECOMMENDATION 1","RECOMMENDATION 2","RECOMMENDATION 3"]:
         out[col] = ""
-    for idx, row in out.iterrows():
-        raw = [row.get("item1",""), row.get("item2",""), row.get("item3","")]
-        cart = normalize_user_items(raw, known_items_lower, lower_to_orig)
-        recs = enhanced_recommend(cart, co_dict, item_type, top_items_by_type, item_tags, blacklist, top_n=top_n)
+    raw = out.reindex(columns=["item1","item2","item3"]).to_numpy(dtype=object)
+    carts = _normalize_carts(raw, known_lower_arr, lower_to_orig)
+    scores = _score_carts(carts, co_norm, co_scale, item_index, item_type_codes,
+                          item_spicy, blacklist, boost_factor)
+    ids, vals = _topk_per_type(scores, item_type_codes, len(ITEM_TYPES), max_per_type, top_n)
+    for r, (idx, cart) in enumerate(zip(out.index, carts)):
+        recs = _pick_diverse(ids[r], vals[r], cart, item_names, item_type_codes,
+                             top_items_by_type, blacklist, top_n, max_per_type)
         for i,(it,_) in enumerate(recs):
             out.at[idx, f"RECOMMENDATION {i+1}"] = it
     return out
\ No newline at end of file
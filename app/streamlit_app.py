@@ -2,17 +2,17 @@
 
 import os, io, requests
 import streamlit as st
+import numpy as np
 import pandas as pd
-from collections import Counter
 from typing import Optional
 
 from data_loader import (
-    build_items_and_tags, build_normalized_comatrix,
-    save_artifact, load_artifact, extract_item_names, clean_item_list
+    build_items_and_tags, build_normalized_comatrix, quantize_comatrix,
+    save_artifacts, load_artifacts, add_lookups, parse_item_lists, read_csv_arrow
 )
 from recommender import enhanced_recommend, batch_predict, normalize_user_items
 from ui_components import (
-    icon_for_item, TYPE_EMOJI, topbar_badges, reco_card, header
+    icon_for_item, TYPE_EMOJI, topbar_badges, reco_card
 )
 
 APP_DIR = os.path.dirname(__file__)
@@ -39,9 +39,20 @@ TEAM = [
 
 st.set_page_config(page_title="SmartCart-Web — Menu Recommender", page_icon="🍗", layout="wide")
 
-# Load CSS
-with open(os.path.join(APP_DIR, "styles.css")) as f:
-    st.markdown(f"<style>{f.read()}</style>", unsafe_allow_html=True)
+# The script body reruns on every interaction; stat the static images once per process
+@st.cache_resource(show_spinner=False)
+def _existing_paths(paths: tuple[str, ...]) -> frozenset[str]:
+    return frozenset(p for p in paths if os.path.exists(p))
+
+_EXISTING_PHOTOS = _existing_paths(tuple(m["photo"] for m in TEAM) + (LOGO_PATH,))
+
+# Load CSS (read from disk once per process)
+@st.cache_resource(show_spinner=False)
+def _css() -> str:
+    with open(os.path.join(APP_DIR, "styles.css")) as f:
+        return f.read()
+
+st.markdown(f"<style>{_css()}</style>", unsafe_allow_html=True)
 
 # ---------- SIDEBAR ----------
 st.sidebar.markdown(
@@ -52,16 +63,9 @@ st.sidebar.markdown(
     """,
     unsafe_allow_html=True
 )
-if os.path.exists(LOGO_PATH):
+if LOGO_PATH in _EXISTING_PHOTOS:
     st.sidebar.image(LOGO_PATH, caption="", use_container_width=True)
 
-page = st.sidebar.radio(
-    "",
-    ["🏁 Start","🧱 Build Model (first run)","🛒 Menu & Recommendations",
-     "📦 Batch Predict (CSV)","📊 Metrics & Explore","🧩 Architecture & Workflow","ℹ️ About"],
-    label_visibility="collapsed"
-)
-
 # ---------- HELPERS ----------
 def app_brand_title():
     st.markdown(
@@ -75,7 +79,7 @@ def app_brand_title():
 
 @st.cache_data(show_spinner=False)
 def load_uploaded_csv(uploaded_file):
-    return pd.read_csv(uploaded_file)
+    return read_csv_arrow(io.BytesIO(uploaded_file.getbuffer()))
 
 def save_uploaded_file(uploaded_file, filename):
     os.makedirs(DATA_DIR, exist_ok=True)
@@ -84,23 +88,70 @@ def save_uploaded_file(uploaded_file, filename):
         f.write(uploaded_file.getbuffer())
     return out_path
 
-def download_from_gdrive(url: str, filename: str):
-    """Download CSV from Google Drive link and save to DATA_DIR."""
+def download_from_gdrive(url: str, filename: str, chunk_size: int = 1 << 20):
+    """
+    Stream a CSV from a Google Drive link to DATA_DIR in fixed-size chunks.
+    A leftover `<filename>.<file_id>.part` from an interrupted download of the
+    same link is resumed via Range/If-Range only when the first response gave
+    an ETag/Last-Modified to check against; anything unverifiable restarts.
+    """
     try:
         file_id = url.split("/d/")[1].split("/")[0]
         download_url = f"https://drive.google.com/uc?export=download&id={file_id}"
-        r = requests.get(download_url)
-        r.raise_for_status()
         os.makedirs(DATA_DIR, exist_ok=True)
         out_path = os.path.join(DATA_DIR, filename)
-        with open(out_path, "wb") as f:
-            f.write(r.content)
+        part_path = os.path.join(DATA_DIR, f"{filename}.{file_id}.part")
+        validator_path = part_path + ".validator"  # ETag / Last-Modified of the first response
+        done = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        if done and not os.path.exists(validator_path):
+            # nothing to check the leftover against: never resume it blindly
+            os.remove(part_path)
+            done = 0
+        headers = {}
+        if done:
+            with open(validator_path) as vf:
+                headers["Range"] = f"bytes={done}-"
+                headers["If-Range"] = vf.read().strip()
+
+        with requests.get(download_url, stream=True, timeout=60, headers=headers) as r:
+            resumed = r.status_code == 206
+            if r.status_code == 416 or (
+                    resumed and not r.headers.get("Content-Range", "").startswith(f"bytes {done}-")):
+                # leftover .part can't be verified against this response: drop it, fetch everything
+                for p in (part_path, validator_path):
+                    if os.path.exists(p):
+                        os.remove(p)
+                return download_from_gdrive(url, filename, chunk_size)
+            r.raise_for_status()
+            if not resumed:  # full body (no Range sent, or If-Range/Range not honoured)
+                done = 0
+                validator = r.headers.get("ETag") or r.headers.get("Last-Modified")
+                if validator:
+                    with open(validator_path, "w") as vf:
+                        vf.write(validator)
+                elif os.path.exists(validator_path):
+                    os.remove(validator_path)
+            if "Content-Length" in r.headers:
+                total = done + int(r.headers["Content-Length"])
+            else:  # fall back to the full size in "bytes start-end/size", if given
+                size = r.headers.get("Content-Range", "").rpartition("/")[2]
+                total = int(size) if resumed and size.isdigit() else 0
+            progress = st.progress(0.0, text=f"Downloading {filename}") if total else None
+            with open(part_path, "ab" if done else "wb") as f:
+                for chunk in r.iter_content(chunk_size=chunk_size):
+                    f.write(chunk)
+                    done += len(chunk)
+                    if progress:
+                        progress.progress(min(done / total, 1.0), text=f"Downloading {filename}")
+        os.replace(part_path, out_path)
+        if os.path.exists(validator_path):
+            os.remove(validator_path)
         return out_path
     except Exception as e:
         st.error(f"Failed to fetch from Google Drive: {e}")
         return None
 
-@st.cache_data(show_spinner=True)
+@st.cache_resource(show_spinner=True)
 def prepare_artifacts(sample_n: Optional[int]):
     order_path = os.path.join(DATA_DIR, "order_data.csv")
     if not os.path.exists(order_path):
@@ -108,8 +159,7 @@ def prepare_artifacts(sample_n: Optional[int]):
         return None
 
     # ✅ Safe large file read
-    order = pd.read_csv(order_path, chunksize=200000)
-    order = pd.concat(order, ignore_index=True)
+    order = read_csv_arrow(order_path)
 
     # ✅ Normalize colnames
     colnames = [c.lower() for c in order.columns]
@@ -120,11 +170,12 @@ def prepare_artifacts(sample_n: Optional[int]):
     orders_col = order.columns[colnames.index("orders")]
 
     # ✅ Extract items from JSON text inside ORDERS column
-    order["ITEM_LIST"] = order[orders_col].apply(extract_item_names).apply(clean_item_list)
+    order["ITEM_LIST"] = parse_item_lists(order[orders_col])
 
     # ✅ Build artifacts
     item_type, item_feat, top_by_type, all_items = build_items_and_tags(order)
-    co_norm = build_normalized_comatrix(order, sample_n=sample_n)
+    co_norm, co_items = build_normalized_comatrix(order, sample_n=sample_n, items=all_items)
+    co_norm, co_scale = quantize_comatrix(co_norm)
 
     known_lower = {itm.lower(): itm for itm in all_items}
     art = {
@@ -132,13 +183,36 @@ def prepare_artifacts(sample_n: Optional[int]):
         "item_feat": item_feat,
         "top_by_type": top_by_type,
         "co_norm": co_norm,
-        "known_items_lower": list(known_lower.keys()),
+        "co_scale": co_scale,
+        "co_items": co_items,
         "lower_to_orig": known_lower,
     }
+    add_lookups(art)
 
-    save_artifact("artifacts.pkl", art)
+    save_artifacts(art)
     return art
 
+@st.cache_resource(show_spinner=False)
+def _artifact_slot() -> dict:
+    """Process-wide holder for the artifact dict shared by all pages (read-only)."""
+    return {}
+
+def load_or_build_artifacts():
+    slot = _artifact_slot()
+    if "art" not in slot:
+        art = load_artifacts()
+        if art is None:
+            st.warning("No artifacts found. Build the model first in 🧱 Build Model.")
+            return None
+        slot["art"] = art
+    return slot["art"]
+
+@st.cache_data(show_spinner=False)
+def item_type_counts(art_id: int, _art: dict) -> pd.DataFrame:
+    """Items per type; keyed on the artifact's identity, `_art` itself is not hashed."""
+    keys, cnts = np.unique(np.fromiter(_art["item_type"].values(), dtype=object), return_counts=True)
+    return pd.DataFrame({"Count": cnts}, index=keys)
+
 # ---------- PAGES ----------
 def start_page():
     app_brand_title()
@@ -182,7 +256,9 @@ def build_model_page():
     if st.button("🚀 Build now"):
         with st.spinner("Crunching pairs & normalizing..."):
             art = prepare_artifacts(sample_n=sample)
-        if art: st.success("Artifacts built and cached at artifacts/artifacts.pkl")
+        if art:
+            _artifact_slot()["art"] = art
+            st.success("Artifacts built and cached under artifacts/")
 
 def menu_reco_page():
     app_brand_title()
@@ -198,13 +274,13 @@ def menu_reco_page():
     topbar_badges(selected, limit=3)
 
     if st.button("🍽️ Recommend", disabled=(len(selected) == 0)):
-        cart = normalize_user_items(selected, art["known_items_lower"], art["lower_to_orig"])
-        recs = enhanced_recommend(cart, art["co_norm"], art["item_type"], art["top_by_type"], art["item_feat"])
+        cart = normalize_user_items(selected, art["known_lower_arr"], art["lower_to_orig"])
+        recs = enhanced_recommend(cart, art["co_norm"], art["co_scale"], art["item_index"], art["item_names"],
+                                  art["item_id_to_type_code"], art["item_spicy"], art["top_by_type"])
         if not recs: st.warning("No recommendations found."); return
-        col_a, col_b, col_c = st.columns(3)
-        for idx, (it, score) in enumerate(recs, start=1):
-            with [col_a, col_b, col_c][idx - 1]:
-                reco_card(idx, it, score, art["item_type"].get(it, "other"))
+        cards = "".join(reco_card(idx, it, score, art["item_type"].get(it, "other"))
+                        for idx, (it, score) in enumerate(recs, start=1))
+        st.markdown(f"<div class='reco-row'>{cards}</div>", unsafe_allow_html=True)
 
 def batch_page():
     app_brand_title()
@@ -218,8 +294,9 @@ def batch_page():
 
     if st.button("Run batch on test_data_question.csv"):
         test_df = pd.read_csv(test_path)
-        out = batch_predict(test_df, art["co_norm"], art["item_type"], art["top_by_type"], art["item_feat"],
-                            art["known_items_lower"], art["lower_to_orig"])
+        out = batch_predict(test_df, art["co_norm"], art["co_scale"], art["item_index"], art["item_names"],
+                            art["item_id_to_type_code"], art["item_spicy"], art["top_by_type"],
+                            art["known_lower_arr"], art["lower_to_orig"])
         out_path = os.path.join(ART_DIR, "SmartCart_Recommendation_Output.csv")
         out.to_csv(out_path, index=False)
         st.success(f"Saved: {out_path}")
@@ -233,18 +310,22 @@ def metrics_page():
     art = load_or_build_artifacts()
     if art is None: return
 
-    counts = Counter(art["item_type"].values())
-    st.bar_chart(pd.DataFrame.from_dict(counts, orient="index", columns=["Count"]))
+    st.bar_chart(item_type_counts(id(art), art))
 
     st.markdown("<h4 class='page-h4'>Top Items by Type</h4>", unsafe_allow_html=True)
     cols = st.columns(4)
     for t, col in zip(["main", "side", "dip", "drink"], cols):
         with col:
             st.markdown(f"**{t.title()}** {TYPE_EMOJI.get(t, '🍽️')}")
-            for it, cnt in art["top_by_type"].get(t, [])[:15]:
-                st.write(f"{icon_for_item(it)} {it} — {cnt}")
+            items_html = "".join(f"<li>{icon_for_item(it)} {it} — {cnt}</li>"
+                                 for it, cnt in art["top_by_type"].get(t, [])[:15])
+            st.markdown(f"<ul class='top-items'>{items_html}</ul>", unsafe_allow_html=True)
 
-def render_workflow_diagram():
+# Pinned version: jsDelivr serves versioned files as immutable, so the browser keeps it cached
+MERMAID_JS = "https://cdn.jsdelivr.net/npm/mermaid@10.9.1/dist/mermaid.min.js"
+
+@st.cache_resource(show_spinner=False)
+def workflow_diagram_html() -> str:
     mermaid_code = """flowchart TD
     subgraph Preprocessing["Data Preprocessing"]
         A["Raw Data (Orders, Customers, Stores)"]
@@ -270,9 +351,12 @@ def render_workflow_diagram():
     F --> G --> H --> I"""
     html = f"""<div style="display:flex;justify-content:center;">
       <div class="mermaid">{mermaid_code}</div></div>
-      <script src="https://cdn.jsdelivr.net/npm/mermaid/dist/mermaid.min.js"></script>
+      <script src="{MERMAID_JS}"></script>
       <script>mermaid.initialize({{startOnLoad:true, theme:"default"}});</script>"""
-    st.components.v1.html(html, height=620, scrolling=True)
+    return html
+
+def render_workflow_diagram():
+    st.components.v1.html(workflow_diagram_html(), height=620, scrolling=True)
 
 def workflow_page():
     app_brand_title()
@@ -286,15 +370,19 @@ def about_page():
     cols = st.columns(3)
     for member, col in zip(TEAM, cols):
         with col:
-            if os.path.exists(member["photo"]): st.image(member["photo"], width=220)
+            if member["photo"] in _EXISTING_PHOTOS: st.image(member["photo"], width=220)
             st.markdown(f"**{member['name']}**")
             st.markdown(f"[LinkedIn]({member['linkedin']})")
 
 # ---------- ROUTER ----------
-if page.startswith("🏁"): start_page()
-elif page.startswith("🧱"): build_model_page()
-elif page.startswith("🛒"): menu_reco_page()
-elif page.startswith("📦"): batch_page()
-elif page.startswith("📊"): metrics_page()
-elif page.startswith("🧩"): workflow_page()
-else: about_page()
+page = st.navigation([
+    st.Page(start_page, title="Start", icon="🏁", default=True),
+    st.Page(build_model_page, title="Build Model (first run)", icon="🧱"),
+    st.Page(menu_reco_page, title="Menu & Recommendations", icon="🛒"),
+    st.Page(batch_page, title="Batch Predict (CSV)", icon="📦"),
+    st.Page(metrics_page, title="Metrics & Explore", icon="📊"),
+    st.Page(workflow_page, title="Architecture & Workflow", icon="🧩"),
+    st.Page(about_page, title="About", icon="ℹ️"),
+])
+page.run()
+
@@ -1,3 +1,6 @@
+import textwrap
+from functools import lru_cache
+
 import streamlit as st
 
 TYPE_EMOJI = {
@@ -8,6 +11,7 @@ TYPE_EMOJI = {
     "other": "🍽️",
 }
 
+@lru_cache(maxsize=512)
 def icon_for_item(name: str) -> str:
     n = name.lower()
     if "wing" in n:
@@ -36,7 +40,8 @@ def topbar_badges(items, limit=3):
         st.markdown(f"<span class='badge'>{icon_for_item(it)} {it}</span>", unsafe_allow_html=True)
     st.markdown("</div>", unsafe_allow_html=True)
 
-def reco_card(rank: int, item_name: str, score: float, typ: str):
+def reco_card(rank: int, item_name: str, score: float, typ: str) -> str:
+    """HTML for one recommendation card; callers join cards and emit them in one st.markdown."""
     emoji = icon_for_item(item_name)
     typ_emoji = TYPE_EMOJI.get(typ, "🍽️")
     html = f"""
@@ -49,4 +54,5 @@ def reco_card(rank: int, item_name: str, score: float, typ: str):
       </div>
     </div>
     """
-    st.markdown(html, unsafe_allow_html=True)
\ No newline at end of file
+    # no blank lines, so joined cards stay one HTML block for the markdown parser
+    return textwrap.dedent(html).strip()